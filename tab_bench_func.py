@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+import argparse
+import io
+import json
+import os
+from pathlib import Path
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/')
+
+# Defaults:{{{1
+# how many times as long as importing the standard library modules it uses the table-building API can take to import in a fresh interpreter
+# a ratio rather than a number of seconds so the budget scales with how fast (and how loaded) the machine is
+importbudget_default = 1.5
+# modules that should not be loaded just by importing the table-building API
+heavymodules_default = ['numpy', 'pandas', 'statsmodels']
+# (number of models, number of coefficients in each model, share of coefficients that are common to every model)
+benchsizes_default = [(5, 10, 1), (20, 100, 1), (20, 100, 0.2), (50, 500, 1), (50, 100, 0.2)]
+benchsizes_quick = [(5, 10, 1), (20, 100, 0.2)]
+
+# Import Time:{{{1
+def getimporttime(modulename, numrepeats = 5):
+    """
+    Time how long it takes to import modulename in a fresh interpreter
+
+    modulename can also be several modules separated by commas (i.e. 'json, os')
+    Run numrepeats times and return the fastest time (in seconds) along with the heavy modules that the import loaded.
+    """
+    code = '; '.join([
+        'import sys',
+        'import time',
+        'sys.path.insert(0, ' + repr(str(__projectdir__)) + ')',
+        'start = time.perf_counter()',
+        'import ' + modulename,
+        'print(time.perf_counter() - start)',
+        'print(",".join([name for name in ' + repr(heavymodules_default) + ' if name in sys.modules]))',
+        ])
+
+    times = []
+    for i in range(numrepeats):
+        output = subprocess.run([sys.executable, '-c', code], check = True, capture_output = True, text = True).stdout.split('\n')
+        times.append(float(output[0]))
+        loadedmodules = [name for name in output[1].split(',') if name != '']
+
+    return(min(times), loadedmodules)
+
+
+def getstdlibimports(modulename):
+    """
+    Return the modules imported at the top of modulename and the tab_ modules it imports (other than the tab_ modules themselves)
+    """
+    import ast
+
+    stdlibimports = set()
+    tomodules = [modulename]
+    donemodules = set()
+    while len(tomodules) > 0:
+        modulename = tomodules.pop()
+        donemodules.add(modulename)
+        with open(__projectdir__ / Path(modulename + '.py')) as f:
+            tree = ast.parse(f.read())
+        # only the imports at the top of the file since the rest are only run when they are needed
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                if name.startswith('tab_'):
+                    if name not in donemodules:
+                        tomodules.append(name)
+                else:
+                    stdlibimports.add(name)
+
+    return(sorted(stdlibimports))
+
+
+def importtime_test(budget = importbudget_default, modulenames = None, numrepeats = 7):
+    """
+    Raise an error if importing the table-building API takes more than budget times as long as importing the standard library modules it uses or loads numpy/pandas/statsmodels
+
+    The standard library imports are timed in a separate fresh interpreter in the same way so the budget only covers the time spent on this package.
+    """
+    if modulenames is None:
+        modulenames = ['tab_general_func', 'tab_sm_func', 'tab_cli_func', 'tab_store_func']
+
+    for modulename in modulenames:
+        # alternate between the two so both see the same load on the machine
+        importtimes = []
+        referencetimes = []
+        for i in range(numrepeats):
+            importtime, loadedmodules = getimporttime(modulename, numrepeats = 1)
+            importtimes.append(importtime)
+            referencetimes.append(getimporttime(', '.join(getstdlibimports(modulename)), numrepeats = 1)[0])
+        importtime = min(importtimes)
+        ratio = importtime / min(referencetimes)
+        print(modulename + ': ' + str(round(importtime * 1000, 1)) + 'ms (' + str(round(ratio, 2)) + ' times its standard library imports)')
+        if len(loadedmodules) > 0:
+            raise ValueError('Importing ' + modulename + ' loads ' + ', '.join(loadedmodules) + '.')
+        if ratio > budget:
+            raise ValueError('Importing ' + modulename + ' took ' + str(round(ratio, 2)) + ' times as long as its standard library imports which is over the budget of ' + str(budget) + '.')
+
+
+# Synthetic Models:{{{1
+def getsyntheticmodels(nummodels, numcoeffs, overlap = 1, seed = 1):
+    """
+    Generate a list of ModelSummary that look like regression results
+
+    nummodels: number of models
+    numcoeffs: number of coefficients in each model
+    overlap: share of the coefficients that appear in every model. The rest are only in that model so overlap < 1 gives sparse tables with nummodels * numcoeffs * (1 - overlap) rows that each have one model.
+    """
+    import numpy as np
+    from tab_sm_func import ModelSummary
+
+    rng = np.random.default_rng(seed)
+    numcommon = int(round(numcoeffs * overlap))
+    commonnames = ['x' + str(i) for i in range(numcommon)]
+
+    models = []
+    for i in range(nummodels):
+        coeffnames = commonnames + ['m' + str(i) + '_z' + str(j) for j in range(numcoeffs - numcommon)]
+        betas = rng.normal(size = numcoeffs)
+        ses = rng.uniform(0.01, 1, size = numcoeffs)
+        pvals = rng.uniform(0, 1, size = numcoeffs) ** 3
+        stats = {'nobs': float(rng.integers(100, 100000)), 'rsquared': float(rng.uniform(0, 1))}
+        models.append(ModelSummary(coeffnames, betas, pvals, ses, stats = stats))
+
+    return(models)
+
+
+# Benchmarks:{{{1
+def timestage(func, repeats = 3):
+    """
+    Return the fastest time in seconds over repeats calls of func and the peak memory allocated by a single call
+    """
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    # measure memory separately since tracemalloc slows everything down
+    tracemalloc.start()
+    func()
+    peakbytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return(min(times), peakbytes)
+
+
+def getbenchstages(models):
+    """
+    Return a dict from stage name to a function running that stage on models
+
+    Each stage starts from the output of the previous stage so its time only covers its own work.
+    """
+    from tab_general_func import getcoefftabmatrixgen
+    from tab_general_func import mergetabsecs
+    from tab_general_func import CsvTarget
+    from tab_general_func import LatexTarget
+    from tab_general_func import printlofl
+    from tab_general_func import rendertargets
+    from tab_general_func import tabularconvert
+    from tab_general_func import TabularFrame
+    from tab_general_func import TextTarget
+    from tab_sm_func import getcoeffmatrices
+    from tab_sm_func import getcoeffmatrices_sparse
+    from tab_sm_func import getsmresultstable
+
+    coefflist, betamatrix, pvalmatrix, sematrix = getcoeffmatrices(models)
+    coefftabmatrix = getcoefftabmatrixgen(coefflist, betamatrix, pvalmatrix, sematrix)
+    sparse = getcoeffmatrices_sparse(models)[1]
+    tabsec = tabularconvert(coefftabmatrix)
+    # split into a few tabsecs to merge
+    tabsecs = [tabsec[: len(tabsec) // 2], tabsec[len(tabsec) // 2: ]] * 5
+    frame = TabularFrame.fromlofl(coefftabmatrix)
+
+    stages = {
+        'getcoeffmatrices': lambda: getcoeffmatrices(models),
+        'getcoeffmatrices_sparse': lambda: getcoeffmatrices_sparse(models),
+        'getcoefftabmatrixgen': lambda: getcoefftabmatrixgen(coefflist, betamatrix, pvalmatrix, sematrix),
+        'getcoefftabmatrixgen_sparse': lambda: getcoefftabmatrixgen(coefflist, sparse, None, None),
+        'tabularconvert': lambda: tabularconvert(coefftabmatrix),
+        'mergetabsecs': lambda: mergetabsecs(tabsecs, colalign = 'l' + 'c' * len(models), hlines = 'all'),
+        'printlofl': lambda: printlofl(coefftabmatrix, file = io.StringIO()),
+        'rendertargets': lambda: rendertargets([frame], [LatexTarget(colalign = 'l' + 'c' * len(models)), TextTarget(file = io.StringIO()), CsvTarget(io.StringIO())], hlines = 'all'),
+        'getsmresultstable': lambda: getsmresultstable(models),
+        }
+
+    return(stages)
+
+
+def runbenchmarks(savename = None, sizes = None, repeats = 3):
+    """
+    Time and memory-profile every table-building stage at increasing table sizes
+
+    sizes: list of (nummodels, numcoeffs, overlap). See getsyntheticmodels.
+    savename: json file to save the results in so they can be compared across releases. Default: temp/benchmarks.json
+    """
+    import numpy as np
+
+    if savename is None:
+        savename = __projectdir__ / Path('temp/benchmarks.json')
+    if sizes is None:
+        sizes = benchsizes_default
+
+    results = []
+    for nummodels, numcoeffs, overlap in sizes:
+        models = getsyntheticmodels(nummodels, numcoeffs, overlap = overlap)
+        stages = getbenchstages(models)
+        for stage in stages:
+            seconds, peakbytes = timestage(stages[stage], repeats = repeats)
+            results.append({'stage': stage, 'nummodels': nummodels, 'numcoeffs': numcoeffs, 'overlap': overlap, 'seconds': seconds, 'peakbytes': peakbytes})
+            print(stage + ' ' + str((nummodels, numcoeffs, overlap)) + ': ' + str(round(seconds * 1000, 2)) + 'ms, ' + str(round(peakbytes / 1024 ** 2, 2)) + 'MB')
+
+    output = {'python': platform.python_version(), 'numpy': np.__version__, 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}
+    os.makedirs(os.path.dirname(os.path.abspath(savename)), exist_ok = True)
+    with open(savename, 'w+') as f:
+        json.dump(output, f, indent = 1)
+
+    return(output)
+
+
+# Allocations:{{{1
+def getinputstages(models):
+    """
+    Return a dict from stage name to (function, kwargs) for the functions that take lists/dicts that the caller keeps using
+
+    None of these functions should change kwargs so callers do not need to copy them first.
+    """
+    from tab_general_func import convertformatnumericmatrix
+    from tab_general_func import getcoefftabmatrixgen
+    from tab_general_func import mergetabsecs
+    from tab_general_func import printlofl
+    from tab_general_func import tabularconvert
+    from tab_sm_func import getcoeffmatrices
+    from tab_sm_func import getcoefftabmatrix
+    from tab_sm_func import getsmresultstable
+
+    coefflist, betamatrix, pvalmatrix, sematrix = getcoeffmatrices(models)
+    coefftabmatrix = getcoefftabmatrixgen(coefflist, betamatrix, pvalmatrix, sematrix)
+    coeffnames = {coeff: coeff.upper() for coeff in coefflist[:: 2]}
+    numcol = len(models)
+
+    stages = {
+        'tabularconvert': (tabularconvert, {'listoflists': coefftabmatrix, 'hlines': [0, 1, -1]}),
+        'printlofl': (lambda **kwargs: printlofl(file = io.StringIO(), **kwargs), {'listoflists': coefftabmatrix, 'maxcolsize': [None] * (numcol + 1)}),
+        'mergetabsecs': (mergetabsecs, {'tabsecslist': [tabularconvert(coefftabmatrix[: 2]), tabularconvert(coefftabmatrix[2: ])], 'hlines': [0, 1, 2]}),
+        'convertformatnumericmatrix': (convertformatnumericmatrix, {'matrix': [[0.5] * numcol for row in range(len(coefflist))], 'decimalpoints': [[i % 4 for i in range(numcol)]]}),
+        'getcoefftabmatrix': (lambda **kwargs: getcoefftabmatrix(models, **kwargs), {'coefflist': coefflist, 'coeffnames': coeffnames}),
+        'getsmresultstable': (lambda **kwargs: getsmresultstable(models, **kwargs), {'coeffnames': coeffnames, 'ynames': ['y'] + ['(' + str(i) + ')' for i in range(numcol)], 'beforelofl': [['Panel A'] + [''] * numcol]}),
+        }
+
+    return(stages)
+
+
+def getpeakbytes(func):
+    tracemalloc.start()
+    func()
+    peakbytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return(peakbytes)
+
+
+def runallocationbenchmarks(savename = None, sizes = None):
+    """
+    Check that no stage changes its inputs and measure the memory callers save by not copying them
+
+    For each stage:
+    peakbytes: peak memory allocated by the call
+    copybytes: peak memory allocated by copy.deepcopy of the inputs. Before the functions promised not to change their inputs, callers had to make this copy before each call.
+    savename: json file to save the results in. Default: temp/allocationbenchmarks.json
+    """
+    import copy
+
+    if savename is None:
+        savename = __projectdir__ / Path('temp/allocationbenchmarks.json')
+    if sizes is None:
+        sizes = benchsizes_default
+
+    results = []
+    for nummodels, numcoeffs, overlap in sizes:
+        models = getsyntheticmodels(nummodels, numcoeffs, overlap = overlap)
+        stages = getinputstages(models)
+        for stage in stages:
+            func, kwargs = stages[stage]
+            before = copy.deepcopy(kwargs)
+            peakbytes = getpeakbytes(lambda: func(**kwargs))
+            if kwargs != before:
+                raise ValueError(stage + ' changed its inputs.')
+            copybytes = getpeakbytes(lambda: copy.deepcopy(kwargs))
+            results.append({'stage': stage, 'nummodels': nummodels, 'numcoeffs': numcoeffs, 'overlap': overlap, 'peakbytes': peakbytes, 'copybytes': copybytes})
+            print(stage + ' ' + str((nummodels, numcoeffs, overlap)) + ': ' + str(round(peakbytes / 1024 ** 2, 2)) + 'MB, copying inputs would add ' + str(round(copybytes / 1024 ** 2, 2)) + 'MB')
+
+    os.makedirs(os.path.dirname(os.path.abspath(savename)), exist_ok = True)
+    with open(savename, 'w+') as f:
+        json.dump({'python': platform.python_version(), 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, f, indent = 1)
+
+    return(results)
+
+
+# Run:{{{1
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--savename', help = 'json file to save the benchmark results in')
+    parser.add_argument('--quick', action = 'store_true', help = 'only run the smaller table sizes')
+    parser.add_argument('--allocations', action = 'store_true', help = 'also check that no stage changes its inputs and save the memory allocated with and without copying them')
+    parser.add_argument('--allocationsavename', help = 'json file to save the allocation results in')
+    parser.add_argument('--importtime', action = 'store_true', help = 'also check the time to import the table-building API (before the benchmarks)')
+    parser.add_argument('--importbudget', type = float, default = importbudget_default, help = 'how many times as long as its standard library imports each module can take to import')
+    args = parser.parse_args()
+
+    if args.importtime is True:
+        importtime_test(budget = args.importbudget)
+    if args.quick is True:
+        sizes = benchsizes_quick
+    else:
+        sizes = benchsizes_default
+    runbenchmarks(savename = args.savename, sizes = sizes)
+    if args.allocations is True:
+        runallocationbenchmarks(savename = args.allocationsavename, sizes = sizes)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import re
+import sys
+import tempfile
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/')
+
+from tab_general_func import TabularFrame
+from tab_general_func import writetabular
+from tab_sm_func import getcoefftabmatrix
+from tab_sm_func import getmodelsummaries
+from tab_sm_func import getparamlist
+from tab_sm_func import getparamtabmatrix
+from tab_sm_func import getsmresultstable
+
+# Defaults:{{{1
+# 100MB
+cachemaxbytes_default = 100 * 1024 ** 2
+# change this whenever the way tables are rendered or stored changes so old entries are not used
+tabcacheversion = 1
+# arguments that do not change the table so are left out of the key
+nonoutputkwargs = ['printtab', 'printmaxcolsize', 'csvname', 'savename', 'instrument']
+# repr of objects that only shows where they are in memory i.e. <TabInstrument object at 0x7f...>
+identityrepre = re.compile(' at 0x[0-9a-fA-F]+>')
+
+# Cache:{{{1
+class TabCache(object):
+    """
+    On-disk cache of rendered tables and tabsecs
+
+    Each entry is stored in cachedir as a json file named by a hash of the numbers in the table and all the formatting arguments, so a table only needs to be rendered again when something in it changes.
+    When the cache is bigger than maxbytes, the least recently used entries are deleted.
+    hits and misses count how often the cache was used since it was opened.
+    """
+
+    def __init__(self, cachedir, maxbytes = cachemaxbytes_default):
+        self.cachedir = Path(cachedir)
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.cachedir, exist_ok = True)
+
+    def getpath(self, key):
+        return(self.cachedir / Path(key + '.json'))
+
+    def get(self, key):
+        """
+        Return the stored value for key or None if key is not in the cache
+        """
+        path = self.getpath(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)['value']
+        except (FileNotFoundError, ValueError, KeyError):
+            self.misses += 1
+            return(None)
+        self.hits += 1
+        # update the modification time so eviction removes the least recently used entries first
+        os.utime(path)
+        return(value)
+
+    def put(self, key, value):
+        """
+        Store value (a string or list of lists of strings) under key
+        """
+        # write to a temporary file and then rename so other processes never read a partial entry
+        fd, tempname = tempfile.mkstemp(dir = self.cachedir, suffix = '.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'value': value}, f)
+            os.replace(tempname, self.getpath(key))
+        except BaseException:
+            # do not leave the temporary file behind
+            try:
+                os.remove(tempname)
+            except FileNotFoundError:
+                None
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache is no bigger than maxbytes
+        """
+        entries = []
+        totalbytes = 0
+        for entry in os.scandir(self.cachedir):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                totalbytes += stat.st_size
+
+        entries.sort()
+        i = 0
+        while totalbytes > self.maxbytes and i < len(entries):
+            try:
+                os.remove(entries[i][2])
+            except FileNotFoundError:
+                None
+            totalbytes -= entries[i][1]
+            i += 1
+
+    def clear(self):
+        for entry in os.scandir(self.cachedir):
+            if entry.name.endswith('.json'):
+                os.remove(entry.path)
+
+    def stats(self):
+        """
+        Return a dict with the number of hits, misses, entries and bytes in the cache
+        """
+        entries = [entry for entry in os.scandir(self.cachedir) if entry.name.endswith('.json')]
+        return({'hits': self.hits, 'misses': self.misses, 'entries': len(entries), 'bytes': sum([entry.stat().st_size for entry in entries])})
+
+
+# Hashing:{{{1
+def gettablekey(tabletype, summaries, kwargs, includecoeffs = True, includestats = True):
+    """
+    Hash the numbers extracted from the summaries along with all the formatting arguments in kwargs
+
+    includecoeffs: include the coefficient names, betas, pvalues and standard errors
+    includestats: include the stats in kwargs['paramlist']
+    Arguments in nonoutputkwargs are skipped. Raise a ValueError for an argument whose repr depends on its memory address.
+    """
+    h = hashlib.sha256()
+    h.update(('tabcache' + str(tabcacheversion) + ';' + tabletype).encode())
+
+    paramlist = getparamlist(kwargs.get('paramlist', 'def'))
+    for summary in summaries:
+        if summary is None:
+            h.update(b'None')
+            continue
+        if includecoeffs is True:
+            h.update(repr(summary.coeffnames).encode())
+            h.update(summary.betas.tobytes())
+            h.update(summary.pvals.tobytes())
+            h.update(summary.ses.tobytes())
+        if includestats is True:
+            h.update(repr([getattr(summary, param) for param in paramlist]).encode())
+
+    # repr of dicts (i.e. stardict, coeffnames) keeps the order they were written in
+    for name in sorted(kwargs):
+        if name in nonoutputkwargs:
+            continue
+        kwargrepr = repr(kwargs[name])
+        # the repr would differ every run so the entry could never be used again
+        if identityrepre.search(kwargrepr) is not None:
+            raise ValueError('Cannot cache a table with ' + name + ' = ' + kwargrepr + ' since its repr depends on where it is in memory.')
+        h.update((name + '=' + kwargrepr + ';').encode())
+
+    return(h.hexdigest())
+
+
+# Cached Tables:{{{1
+def getmatrix_cached(cache, key, getmatrix, summaries, kwargs):
+    """
+    Return the stored listoflists/tabsec/TabularFrame for key or get it with getmatrix(summaries, **kwargs) and store it
+
+    A TabularFrame is stored as a list with a listoflists for each section and made again on a hit
+    """
+    # returntabsec takes priority over returnframe
+    returnframe = kwargs.get('returnframe', False) is True and kwargs.get('returntabsec', False) is not True
+
+    value = cache.get(key)
+    if value is None:
+        matrix = getmatrix(summaries, **kwargs)
+        if returnframe is True:
+            cache.put(key, [section.tolofl() for section in matrix.sections()])
+        else:
+            cache.put(key, matrix)
+    elif returnframe is True:
+        matrix = TabularFrame.concat(value)
+    else:
+        matrix = value
+
+    return(matrix)
+
+
+def getsmresultstable_cached(cache, sm_models, **kwargs):
+    """
+    getsmresultstable but return the stored tabular if the numbers and arguments have not changed
+
+    cache: a TabCache
+    kwargs: any arguments of getsmresultstable
+    savename is still written on a hit. printtab only prints and csvname is only written when the table is rendered.
+    """
+    savename = kwargs.pop('savename', None)
+
+    summaries = getmodelsummaries(sm_models, paramlist = kwargs.get('paramlist', 'def'))
+    key = gettablekey('getsmresultstable', summaries, kwargs)
+
+    tabular = cache.get(key)
+    if tabular is None:
+        tabular = getsmresultstable(summaries, **kwargs)
+        cache.put(key, tabular)
+
+    if savename is not None:
+        writetabular([tabular], savename)
+
+    return(tabular)
+
+
+def getcoefftabmatrix_cached(cache, sm_models, **kwargs):
+    """
+    getcoefftabmatrix but return the stored listoflists/tabsec/TabularFrame if the coefficients and arguments have not changed
+    """
+    summaries = getmodelsummaries(sm_models, paramlist = None)
+    key = gettablekey('getcoefftabmatrix', summaries, kwargs, includestats = False)
+
+    return(getmatrix_cached(cache, key, getcoefftabmatrix, summaries, kwargs))
+
+
+def getparamtabmatrix_cached(cache, sm_models, **kwargs):
+    """
+    getparamtabmatrix but return the stored listoflists/tabsec/TabularFrame if the stats and arguments have not changed
+    """
+    summaries = getmodelsummaries(sm_models, paramlist = kwargs.get('paramlist', 'def'))
+    key = gettablekey('getparamtabmatrix', summaries, kwargs, includecoeffs = False)
+
+    return(getmatrix_cached(cache, key, getparamtabmatrix, summaries, kwargs))
+
+
+def getsmresultstable_cached_test():
+    from tab_sm_func import getmodelstest
+    models = getmodelstest()
+
+    cache = TabCache(__projectdir__ / Path('temp/tabcache/'), maxbytes = 10000)
+    cache.clear()
+
+    # first is a miss, second is a hit
+    for i in range(2):
+        getsmresultstable_cached(cache, models, coeffdecimal = 2, stardict = 'noplus', savename = __projectdir__ / Path('temp/getsmresultstable_cached_test.tex'))
+    # different arguments so a miss
+    getcoefftabmatrix_cached(cache, models, coeffnames = {'x1': 'X1'}, returntabsec = True)
+    getparamtabmatrix_cached(cache, models, paramlist = ['nobs', 'aic'], paramdecimal = [0, 2])
+    # a TabularFrame is stored as listoflists
+    for i in range(2):
+        getcoefftabmatrix_cached(cache, models, returnframe = True)
+
+    print(cache.stats())
+
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+from pathlib import Path
+import sys
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/')
+
+from tab_general_func import AtomicOutput
+from tab_general_func import getoutputchanged
+from tab_sm_func import ModelSummary
+from tab_sm_func import getsmresultstable
+
+# Defaults:{{{1
+# file extensions for saved summaries
+# tabstore is a folder of memory-mapped arrays (see tab_store_func)
+summaryformats = ['json', 'npz', 'parquet', 'tabstore']
+
+# Summary Files:{{{1
+def getsummaryformat(filename):
+    summaryformat = Path(filename).suffix.lower().lstrip('.')
+    if summaryformat not in summaryformats:
+        raise ValueError('Summaries should be saved as ' + ', '.join(summaryformats) + ' not ' + str(filename) + '.')
+    return(summaryformat)
+
+
+def savesummaries(summaries, savename):
+    """
+    Save a list of ModelSummary (or None) so tables can be made from them later without statsmodels
+
+    The format is given by the extension of savename (json, npz, parquet or tabstore)
+    Get the summaries with getmodelsummaries(sm_models, paramlist) including every stat needed in any table.
+    savename is replaced atomically so a process loading it (i.e. tab_server_func) never reads a partly written file.
+    """
+    summaryformat = getsummaryformat(savename)
+    if summaryformat == 'json':
+        savesummaries_json(summaries, savename)
+    elif summaryformat == 'npz':
+        savesummaries_npz(summaries, savename)
+    elif summaryformat == 'parquet':
+        savesummaries_parquet(summaries, savename)
+    else:
+        from tab_store_func import savestore
+        savestore(summaries, savename)
+
+
+def loadsummaries(filename):
+    """
+    Load a list of ModelSummary (or None) saved by savesummaries
+    """
+    summaryformat = getsummaryformat(filename)
+    if summaryformat == 'json':
+        return(loadsummaries_json(filename))
+    elif summaryformat == 'npz':
+        return(loadsummaries_npz(filename))
+    elif summaryformat == 'parquet':
+        return(loadsummaries_parquet(filename))
+    else:
+        from tab_store_func import loadstore
+        return(loadstore(filename))
+
+
+def savesummaries_json(summaries, savename):
+    """
+    List with one dict for each model with coeffnames, betas, pvals, ses and stats (null for a missing model)
+    """
+    output = []
+    for summary in summaries:
+        if summary is None:
+            output.append(None)
+        else:
+            output.append({'coeffnames': summary.coeffnames, 'betas': summary.betas.tolist(), 'pvals': summary.pvals.tolist(), 'ses': summary.ses.tolist(), 'stats': summary.stats})
+
+    with AtomicOutput(savename) as f:
+        json.dump(output, f)
+
+
+def loadsummaries_json(filename):
+    with open(filename) as f:
+        summarydicts = json.load(f)
+
+    summaries = []
+    for summarydict in summarydicts:
+        if summarydict is None:
+            summaries.append(None)
+        else:
+            summaries.append(ModelSummary(summarydict['coeffnames'], summarydict['betas'], summarydict['pvals'], summarydict['ses'], stats = summarydict.get('stats')))
+
+    return(summaries)
+
+
+def savesummaries_npz(summaries, savename):
+    """
+    Arrays nummodels and then i_coeffnames, i_betas, i_pvals, i_ses, i_statnames and i_statvalues for each model i that is not None
+
+    Everything is saved as numpy arrays (not pickled objects) so the file can be loaded with allow_pickle = False
+    """
+    import numpy as np
+
+    arrays = {'nummodels': np.array(len(summaries))}
+    for i in range(len(summaries)):
+        summary = summaries[i]
+        if summary is None:
+            continue
+        arrays[str(i) + '_coeffnames'] = np.array(summary.coeffnames, dtype = str)
+        arrays[str(i) + '_betas'] = summary.betas
+        arrays[str(i) + '_pvals'] = summary.pvals
+        arrays[str(i) + '_ses'] = summary.ses
+        arrays[str(i) + '_statnames'] = np.array(list(summary.stats), dtype = str)
+        arrays[str(i) + '_statvalues'] = np.array([summary.stats[stat] for stat in summary.stats], dtype = float)
+
+    # np.savez adds .npz to a filename without it
+    if not str(savename).endswith('.npz'):
+        savename = str(savename) + '.npz'
+    with AtomicOutput(savename, mode = 'wb') as f:
+        np.savez(f.file, **arrays)
+
+
+def loadsummaries_npz(filename):
+    import numpy as np
+
+    summaries = []
+    with np.load(filename, allow_pickle = False) as arrays:
+        for i in range(int(arrays['nummodels'])):
+            if str(i) + '_betas' not in arrays:
+                summaries.append(None)
+                continue
+            stats = dict(zip(arrays[str(i) + '_statnames'].tolist(), arrays[str(i) + '_statvalues'].tolist()))
+            summaries.append(ModelSummary(arrays[str(i) + '_coeffnames'].tolist(), arrays[str(i) + '_betas'], arrays[str(i) + '_pvals'], arrays[str(i) + '_ses'], stats = stats))
+
+    return(summaries)
+
+
+def savesummaries_parquet(summaries, savename):
+    """
+    One row per coefficient with columns model, coeffname, beta, pval and se. The stats for each model are saved as json in the metadata.
+
+    Needs pyarrow
+    """
+    import numpy as np
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Saving summaries as parquet needs pyarrow.')
+
+    present = [i for i in range(len(summaries)) if summaries[i] is not None]
+    columns = {
+        'model': np.concatenate([np.full(len(summaries[i].betas), i, dtype = np.int64) for i in present] + [np.zeros(0, dtype = np.int64)]),
+        'coeffname': [coeffname for i in present for coeffname in summaries[i].coeffnames],
+        'beta': np.concatenate([summaries[i].betas for i in present] + [np.zeros(0)]),
+        'pval': np.concatenate([summaries[i].pvals for i in present] + [np.zeros(0)]),
+        'se': np.concatenate([summaries[i].ses for i in present] + [np.zeros(0)]),
+        }
+    stats = [None if summary is None else summary.stats for summary in summaries]
+
+    table = pyarrow.table(columns)
+    table = table.replace_schema_metadata({'tab_stats': json.dumps(stats)})
+    with AtomicOutput(savename, mode = 'wb') as f:
+        pyarrow.parquet.write_table(table, f.file)
+
+
+def loadsummaries_parquet(filename):
+    import numpy as np
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Loading summaries from parquet needs pyarrow.')
+
+    table = pyarrow.parquet.read_table(filename)
+    stats = json.loads(table.schema.metadata[b'tab_stats'])
+    models = table.column('model').to_numpy()
+    coeffnames = table.column('coeffname').to_pylist()
+    betas = table.column('beta').to_numpy()
+    pvals = table.column('pval').to_numpy()
+    ses = table.column('se').to_numpy()
+
+    # rows for each model in the order they were saved
+    order = np.argsort(models, kind = 'stable')
+    starts = np.searchsorted(models[order], np.arange(len(stats) + 1))
+
+    summaries = []
+    for i in range(len(stats)):
+        if stats[i] is None:
+            summaries.append(None)
+            continue
+        rows = order[starts[i]: starts[i + 1]]
+        summaries.append(ModelSummary([coeffnames[row] for row in rows.tolist()], betas[rows], pvals[rows], ses[rows], stats = stats[i]))
+
+    return(summaries)
+
+
+# Table Specs:{{{1
+def loadspecs(specname):
+    """
+    Load the table specs in a json file
+
+    The file holds one spec or a list of specs. Each spec is a dict with:
+    summaries: file saved by savesummaries (relative to the folder of the spec file)
+    models = None: indices of the models in summaries to include in the table (null for an empty column). If None, include every model.
+    savename: .tex file to write (relative to the folder of the spec file)
+    Any other arguments of getsmresultstable i.e. coeffnames, coeffdecimal, paramlist, ynames (csvname is also relative to the spec file)
+    """
+    with open(specname) as f:
+        specs = json.load(f)
+    if isinstance(specs, dict):
+        specs = [specs]
+
+    specdir = Path(os.path.dirname(os.path.abspath(specname)))
+    for spec in specs:
+        for name in ['summaries', 'savename', 'csvname']:
+            if spec.get(name) is not None:
+                spec[name] = specdir / Path(spec[name])
+        # json only has string keys
+        if isinstance(spec.get('stardict'), dict):
+            spec['stardict'] = {float(siglevel): spec['stardict'][siglevel] for siglevel in spec['stardict']}
+
+    return(specs)
+
+
+def rendertablespec(spec, loadedsummaries = None):
+    """
+    Make the table for a single spec (see loadspecs) and return the tabular
+
+    loadedsummaries: dict from summaries filename to the loaded summaries so each file is only read once when rendering many specs
+    """
+    if loadedsummaries is None:
+        loadedsummaries = {}
+
+    spec = dict(spec)
+    summariesname = spec.pop('summaries')
+    models = spec.pop('models', None)
+
+    if summariesname not in loadedsummaries:
+        loadedsummaries[summariesname] = loadsummaries(summariesname)
+    summaries = loadedsummaries[summariesname]
+    if models is not None:
+        summaries = [None if i is None else summaries[i] for i in models]
+
+    return(getsmresultstable(summaries, **spec))
+
+
+def renderspecfiles(specnames, verbose = True, failed = None):
+    """
+    Render every spec in the spec files and return a list of the savenames that changed
+
+    An error in one spec (or a spec file I cannot load) is printed and the other specs are still rendered.
+    failed = None: list to which I add the savename of each spec (or the spec file) that failed
+    """
+    import traceback
+
+    loadedsummaries = {}
+    changed = []
+    for specname in specnames:
+        try:
+            specs = loadspecs(specname)
+        except Exception:
+            print('Error loading ' + str(specname) + ':')
+            print(traceback.format_exc())
+            if failed is not None:
+                failed.append(specname)
+            continue
+
+        for spec in specs:
+            try:
+                rendertablespec(spec, loadedsummaries = loadedsummaries)
+            except Exception:
+                print('Error rendering ' + str(spec.get('savename')) + ':')
+                print(traceback.format_exc())
+                if failed is not None:
+                    failed.append(spec.get('savename'))
+                continue
+            if spec.get('savename') is not None and getoutputchanged(spec['savename']) is True:
+                changed.append(spec['savename'])
+                if verbose is True:
+                    print('Wrote ' + str(spec['savename']) + '.')
+
+    return(changed)
+
+
+def renderspecfiles_test():
+    from tab_sm_func import getmodelstest
+    from tab_sm_func import getmodelsummaries
+
+    summaries = getmodelsummaries(getmodelstest(), paramlist = ['nobs', 'rsquared', 'ess'])
+    specdir = __projectdir__ / Path('temp/renderspecfiles_test/')
+    os.makedirs(specdir, exist_ok = True)
+
+    savesummaries(summaries, specdir / Path('summaries.json'))
+    savesummaries(summaries, specdir / Path('summaries.npz'))
+    savesummaries(summaries, specdir / Path('summaries.tabstore'))
+    specs = [
+        {'summaries': 'summaries.json', 'savename': 'table_json.tex', 'coeffnames': {'x1': 'X1'}, 'stardict': {'0.05': '*'}},
+        {'summaries': 'summaries.npz', 'savename': 'table_npz.tex', 'models': [0, None, 2], 'paramlist': ['nobs', 'ess'], 'paramdecimal': [0, 2]},
+        {'summaries': 'summaries.tabstore', 'savename': 'table_tabstore.tex', 'models': [0, None, 2], 'paramlist': ['nobs', 'ess'], 'paramdecimal': [0, 2]},
+        ]
+    with open(specdir / Path('specs.json'), 'w+') as f:
+        json.dump(specs, f)
+
+    renderspecfiles([specdir / Path('specs.json')])
+
+
+# Run:{{{1
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Write .tex tables from saved model summaries without statsmodels')
+    parser.add_argument('specnames', nargs = '+', help = 'json files with the table specs (see loadspecs)')
+    parser.add_argument('--quiet', action = 'store_true', help = 'do not print the tables that changed')
+    args = parser.parse_args()
+
+    failed = []
+    renderspecfiles(args.specnames, verbose = not args.quiet, failed = failed)
+    if len(failed) > 0:
+        sys.exit(1)
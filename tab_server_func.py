@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+from pathlib import Path
+import sys
+import time
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/')
+
+from tab_cli_func import loadspecs
+from tab_cli_func import loadsummaries
+from tab_cli_func import rendertablespec
+
+# Defaults:{{{1
+# seconds between checking the spec and summaries files
+pollinterval_default = 0.2
+
+# Server:{{{1
+def getmtime(filename):
+    """
+    Return the modification time of filename in nanoseconds or None if it does not exist
+    """
+    try:
+        return(os.stat(filename).st_mtime_ns)
+    except FileNotFoundError:
+        return(None)
+
+
+def getspeckey(spec, i):
+    """
+    Identify a spec within its spec file by its savename (or its position if it has no savename) so I can tell which specs changed
+    """
+    if spec.get('savename') is not None:
+        return(str(spec['savename']))
+    return(i)
+
+
+class TableServer(object):
+    """
+    Long-running process that keeps the model summaries in memory and re-renders tables when their spec files change
+
+    specnames: json spec files (see tab_cli_func.loadspecs)
+    Each poll checks the modification times of the spec files and the summaries files they use:
+        If a spec file changed, only the specs in it that are new or different are rendered again.
+        If a summaries file changed, it is loaded again and every spec that uses it is rendered again.
+    Nothing else is loaded or imported again so a change to coeffnames/decimals/hlines is written within one poll.
+    An error in one spec (or a spec file that is not valid json) is printed and the server keeps going.
+    """
+
+    def __init__(self, specnames, verbose = True):
+        self.specnames = [os.path.abspath(specname) for specname in specnames]
+        self.verbose = verbose
+        # specname: modification time when it was last loaded
+        self.specmtimes = {}
+        # specname: {speckey: spec}
+        self.specs = {}
+        # summariesname: summaries
+        self.loadedsummaries = {}
+        # summariesname: modification time of the version that was loaded
+        self.summarymtimes = {}
+        # summariesname: modification time of the version that could not be loaded (i.e. partly written) so I try again when it changes
+        self.failedmtimes = {}
+
+    def getloadedsummaries(self, summariesname):
+        if summariesname not in self.loadedsummaries:
+            # get the modification time before loading so a change during the load is picked up by the next poll
+            mtime = getmtime(summariesname)
+            try:
+                summaries = loadsummaries(summariesname)
+            except Exception:
+                self.failedmtimes[summariesname] = mtime
+                raise
+            self.failedmtimes.pop(summariesname, None)
+            self.summarymtimes[summariesname] = mtime
+            self.loadedsummaries[summariesname] = summaries
+        return(self.loadedsummaries)
+
+    def getwatchedsummaries(self):
+        """
+        Return the summaries files used by any spec (whether or not they loaded)
+        """
+        watched = set(self.loadedsummaries) | set(self.failedmtimes)
+        for specs in self.specs.values():
+            for spec in specs.values():
+                if spec.get('summaries') is not None:
+                    watched.add(spec['summaries'])
+        return(watched)
+
+    def render(self, spec):
+        """
+        Render a single spec and return whether it worked
+        """
+        try:
+            rendertablespec(spec, loadedsummaries = self.getloadedsummaries(spec['summaries']))
+        except Exception:
+            import traceback
+            print('Error rendering ' + str(spec.get('savename')) + ':')
+            print(traceback.format_exc())
+            return(False)
+        if self.verbose is True:
+            print('Rendered ' + str(spec.get('savename')) + '.')
+        return(True)
+
+    def poll(self):
+        """
+        Render every spec affected by a change since the last poll and return the list of specs rendered
+        """
+        torender = []
+
+        # summaries files that changed since they were loaded or since they last failed to load
+        changedsummaries = set()
+        for summariesname in self.getwatchedsummaries():
+            mtime = getmtime(summariesname)
+            if summariesname in self.loadedsummaries:
+                if mtime != self.summarymtimes[summariesname]:
+                    del self.loadedsummaries[summariesname]
+                    del self.summarymtimes[summariesname]
+                    changedsummaries.add(summariesname)
+            elif summariesname in self.failedmtimes:
+                if mtime != self.failedmtimes[summariesname]:
+                    changedsummaries.add(summariesname)
+
+        for specname in self.specnames:
+            mtime = getmtime(specname)
+            if mtime is None:
+                continue
+
+            if mtime != self.specmtimes.get(specname):
+                try:
+                    specs = loadspecs(specname)
+                except Exception as e:
+                    print('Error loading ' + specname + ': ' + str(e))
+                    # try again when it changes
+                    self.specmtimes[specname] = mtime
+                    # keep the specs from the last time it loaded (if any) so changes to their summaries are still rendered
+                    self.specs.setdefault(specname, {})
+                    continue
+                self.specmtimes[specname] = mtime
+                oldspecs = self.specs.get(specname, {})
+                newspecs = {getspeckey(specs[i], i): specs[i] for i in range(len(specs))}
+                for speckey in newspecs:
+                    if newspecs[speckey] != oldspecs.get(speckey) or newspecs[speckey].get('summaries') in changedsummaries:
+                        torender.append(newspecs[speckey])
+                self.specs[specname] = newspecs
+            else:
+                for spec in self.specs[specname].values():
+                    if spec.get('summaries') in changedsummaries:
+                        torender.append(spec)
+
+        for spec in torender:
+            self.render(spec)
+
+        return(torender)
+
+    def serve(self, interval = pollinterval_default, maxpolls = None):
+        """
+        Poll every interval seconds until interrupted (or maxpolls polls)
+        """
+        numpolls = 0
+        try:
+            while maxpolls is None or numpolls < maxpolls:
+                self.poll()
+                numpolls += 1
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            None
+
+
+def tableserver_test():
+    import json
+    from tab_cli_func import renderspecfiles_test
+
+    # make summaries and a spec file
+    renderspecfiles_test()
+    specname = __projectdir__ / Path('temp/renderspecfiles_test/specs.json')
+
+    server = TableServer([specname])
+    # first poll renders every spec
+    print(len(server.poll()))
+    # nothing changed
+    print(len(server.poll()))
+
+    # change one spec
+    with open(specname) as f:
+        specs = json.load(f)
+    specs[0]['coeffdecimal'] = 2
+    with open(specname, 'w+') as f:
+        json.dump(specs, f)
+    # make sure the modification time changes even on filesystems with coarse times
+    os.utime(specname, ns = (time.time_ns(), time.time_ns() + 10 ** 9))
+    print(len(server.poll()))
+
+    # a spec file that is not valid json is reported and the server keeps going
+    badspecname = __projectdir__ / Path('temp/renderspecfiles_test/badspecs.json')
+    with open(badspecname, 'w+') as f:
+        f.write('{bad json')
+    server = TableServer([badspecname])
+    print(len(server.poll()))
+    print(len(server.poll()))
+
+
+# Run:{{{1
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Re-render .tex tables whenever their spec files or summaries change')
+    parser.add_argument('specnames', nargs = '+', help = 'json files with the table specs (see tab_cli_func.loadspecs)')
+    parser.add_argument('--interval', type = float, default = pollinterval_default, help = 'seconds between checking for changes')
+    parser.add_argument('--once', action = 'store_true', help = 'render every spec once and stop')
+    parser.add_argument('--quiet', action = 'store_true', help = 'do not print the tables rendered')
+    args = parser.parse_args()
+
+    server = TableServer(args.specnames, verbose = not args.quiet)
+    if args.once is True:
+        server.poll()
+    else:
+        server.serve(interval = args.interval)
@@ -1,24 +1,34 @@
 #!/usr/bin/env python3
 
-import copy
 import decimal
-import numpy as np
 import os
-import pandas as pd
 from pathlib import Path
-import statsmodels.formula.api as smf
 import sys
+import weakref
 
 __projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/')
 
 
 from tab_general_func import printlofl
 from tab_general_func import tabularconvert
-from tab_general_func import mergetabsecs
 from tab_general_func import getcoefftabmatrixgen
+from tab_general_func import TabInstrument
+from tab_general_func import TabularFrame
+from tab_general_func import SparseCoeffMatrix
+from tab_general_func import LatexTarget
+from tab_general_func import TextTarget
+from tab_general_func import CsvTarget
+from tab_general_func import rendertargets
+from tab_general_func import changedoutputs
+from tab_general_func import getoutputchanged
 
 # Test Auxilliary Functions:{{{1
 def getmodelstest():
+    # import here since only needed for the test models and these are slow to import
+    import numpy as np
+    import pandas as pd
+    import statsmodels.formula.api as smf
+
     # set random number seed
     np.random.seed(1)
 
@@ -38,61 +48,203 @@ def getmodelstest():
     return([model1, model2, model3])
 
 
-# Get Matrices from Model List:{{{1
-def getcoeffmatrices(sm_models, coefflist = None, coefflist_dropdummies = False):
+# Model Summaries:{{{1
+class ModelSummary(object):
     """
-    sm_models should be a list of model.fit() from statsmodels
-    Allow for models to be None (may be useful when doing multiple panels)
+    Compact copy of the parts of a fitted model that I need to make a table
+
+    Holds the coefficient names, arrays of betas/pvalues/standard errors and a dict of the scalar stats in paramlist so the fitted model (with its design matrices and residuals) can be dropped as soon as the summary is made.
+    Can be used anywhere a fitted model can be used in sm_models. Stats are accessed as attributes i.e. summary.nobs like the fitted model.
+    """
+    __slots__ = ('coeffnames', 'betas', 'pvals', 'ses', 'stats')
+
+    def __init__(self, coeffnames, betas, pvals, ses, stats = None):
+        import numpy as np
+
+        self.coeffnames = list(coeffnames)
+        self.betas = np.asarray(betas, dtype = float)
+        self.pvals = np.asarray(pvals, dtype = float)
+        self.ses = np.asarray(ses, dtype = float)
+        if stats is None:
+            stats = {}
+        self.stats = dict(stats)
+
+        if not (len(self.coeffnames) == len(self.betas) == len(self.pvals) == len(self.ses)):
+            raise ValueError('coeffnames, betas, pvals and ses should have the same length.')
+
+    def __getattr__(self, name):
+        # only called if name is not a slot
+        # stats may not be set yet when unpickling
+        if name == 'stats':
+            raise AttributeError(name)
+        try:
+            return(self.stats[name])
+        except KeyError:
+            raise AttributeError('ModelSummary does not include ' + name + '. Include it in paramlist when creating the summary.')
+
+    def __repr__(self):
+        return('ModelSummary(' + str(len(self.coeffnames)) + ' coefficients, stats: ' + ', '.join(self.stats) + ')')
+
+
+def getparamlist(paramlist = 'def'):
+    """
+    Convert paramlist shortcuts into a list of stats
+    """
+    if paramlist == 'def':
+        paramlist = ['nobs', 'rsquared']
+    if paramlist == 'nor2':
+        paramlist = ['nobs']
+    if paramlist is None:
+        paramlist = []
+    return(paramlist)
+
+
+def getmodelcoeffs(model):
+    """
+    Return the coefficient names and the arrays of betas, pvalues and standard errors for a fitted model or ModelSummary
+    """
+    if isinstance(model, ModelSummary):
+        return(model.coeffnames, model.betas, model.pvals, model.ses)
+
+    params = model.params
+    # statsmodels sets std as bse in the model results
+    # linearmodels sets std as std_errors in the model results
+    # allow for difference
+    try:
+        ses = model.std_errors.to_numpy()
+    except Exception:
+        ses = model.bse.to_numpy()
+    return(list(params.index), params.to_numpy(), model.pvalues.to_numpy(), ses)
+
+
+# stats already taken from each fitted model
+# weak keys so the stats are dropped when the model is deleted
+modelstatscache = weakref.WeakKeyDictionary()
+
+
+def getmodelstats(model, paramlist):
+    """
+    Return the values of the stats in paramlist for model in one pass
+
+    On statsmodels results, stats like aic, llf, rsquared_adj and ess can be expensive to compute so each stat is only taken from the model once and kept in modelstatscache. Tables made from the same models then share the stats.
+    """
+    if isinstance(model, ModelSummary):
+        return([getattr(model, param) for param in paramlist])
+
+    try:
+        modelstats = modelstatscache.setdefault(model, {})
+    except TypeError:
+        # model cannot be weakly referenced so do not cache
+        modelstats = {}
+
+    for param in paramlist:
+        if param not in modelstats:
+            modelstats[param] = getattr(model, param)
+
+    return([modelstats[param] for param in paramlist])
+
+
+def clearmodelstatscache():
+    modelstatscache.clear()
+
+
+def getmodelsummary(model, paramlist = 'def'):
     """
+    Get a ModelSummary from a fitted model with the stats in paramlist (same options as getsmresultstable)
 
+    Allow for model to be None (returns None) or already a ModelSummary (returned as it is)
+    """
+    if model is None or isinstance(model, ModelSummary):
+        return(model)
+
+    paramlist = getparamlist(paramlist)
+
+    coeffnames, betas, pvals, ses = getmodelcoeffs(model)
+    stats = dict(zip(paramlist, getmodelstats(model, paramlist)))
+
+    return(ModelSummary(coeffnames, betas, pvals, ses, stats = stats))
+
+
+def getmodelsummaries(sm_models, paramlist = 'def'):
+    """
+    Convert a list of fitted models into a list of ModelSummary so the fitted models can be deleted
+    """
+    return([getmodelsummary(model, paramlist = paramlist) for model in sm_models])
+
+
+def getmodelsummaries_test():
+    models = getmodelstest()
+    summaries = getmodelsummaries(models, paramlist = ['nobs', 'ess'])
+    # fitted models no longer needed
+    del models
+
+    print(summaries)
+    getsmresultstable(summaries, paramlist = ['nobs', 'ess'], printtab = True)
+
+
+# Get Matrices from Model List:{{{1
+def getcoeffrows(sm_models, coefflist = None, coefflist_dropdummies = False):
+    """
+    Return coefflist (all the coefficients in sm_models in the order I first see them if coefflist is None) and a dict from each coefficient to its row in the table
+    """
     # get coefflist if coefflist is None
     if coefflist is None:
-        coefflist = []
+        # use a dict as an ordered set so the coefficients stay in the order I first see them
+        coeffdict = {}
         for model in sm_models:
             if model is None:
                 continue
-            coeffs = list(model.params.index)
-            for coeff in coeffs:
-                if coeff not in coefflist:
-                    coefflist.append(coeff)
-        if coefflist_dropdummies is True:
-            coefflist = [coeff for coeff in coefflist if 'C(' not in coeff]
-    numrow = len(coefflist)
+            for coeff in getmodelcoeffs(model)[0]:
+                # drop dummies before I extract anything
+                if coefflist_dropdummies is True and 'C(' in coeff:
+                    continue
+                coeffdict[coeff] = None
+        coefflist = list(coeffdict)
     if len(sm_models) == 0:
         raise ValueError('No models specified.')
-    numcol = len(sm_models)
 
-    # create empty list
-    betamatrix = [None] * (numrow * numcol)
-    # reshape as listoflists
-    betamatrix = [betamatrix[i: i + numcol] for i in range(0, len(betamatrix), numcol)]
+    # row of each coefficient in the table
+    # if a coefficient appears twice in coefflist, use the first row
+    coeffrows = {}
+    for row in range(len(coefflist)):
+        coeffrows.setdefault(coefflist[row], row)
+
+    return(coefflist, coeffrows)
+
+
+def getcoeffmatrices(sm_models, coefflist = None, coefflist_dropdummies = False, instrument = None):
+    """
+    sm_models should be a list of model.fit() from statsmodels or ModelSummary
+    Allow for models to be None (may be useful when doing multiple panels)
+    instrument = None: TabInstrument to record the time taken
+    """
+    if instrument is not None:
+        starttime = instrument.start()
 
-    # create additional empty matrices
-    pvalmatrix = copy.deepcopy(betamatrix)
-    sematrix = copy.deepcopy(betamatrix)
+    coefflist, coeffrows = getcoeffrows(sm_models, coefflist = coefflist, coefflist_dropdummies = coefflist_dropdummies)
+    numrow = len(coefflist)
+    numcol = len(sm_models)
+
+    # create empty lists
+    betamatrix = [[None] * numcol for row in range(numrow)]
+    pvalmatrix = [[None] * numcol for row in range(numrow)]
+    sematrix = [[None] * numcol for row in range(numrow)]
 
     for col in range(numcol):
         if sm_models[col] is None:
             continue
-        betas = list(sm_models[col].params)
-        pvals = list(sm_models[col].pvalues)
-        # statsmodels sets std as bse in the model results
-        # linearmodels sets std as std_errors in the model results
-        # allow for difference
-        try:
-            ses = list(sm_models[col].std_errors)
-        except Exception:
-            ses = list(sm_models[col].bse)
-        coeffs = list(sm_models[col].params.index)
-        coeffs = list(sm_models[col].params.index)
-        for thisregi in range(len(betas)):
-            coeff = coeffs[thisregi]
-            if coeff in coefflist:
-                row = coefflist.index(coeff)
-
+        coeffs, betas, pvals, ses = getmodelcoeffs(sm_models[col])
+        thisregi = 0
+        for coeff in coeffs:
+            row = coeffrows.get(coeff)
+            if row is not None:
                 betamatrix[row][col] = betas[thisregi]
                 pvalmatrix[row][col] = pvals[thisregi]
                 sematrix[row][col] = ses[thisregi]
+            thisregi += 1
+
+    if instrument is not None:
+        instrument.record('extractcoeffs', starttime, cells = numrow * numcol)
 
     return(coefflist, betamatrix, pvalmatrix, sematrix)
             
@@ -112,13 +264,66 @@ def getcoeffmatrices_test():
     print(sematrix)
 
 # getcoeffmatrices_test()
-def getparammatrix(sm_models, paramlist = 'def'):
-    if paramlist == 'def':
-        paramlist = ['nobs', 'rsquared']
-    if paramlist == 'nor2':
-        paramlist = ['nobs']
-    if paramlist is None:
-        paramlist = []
+def getcoeffmatrices_sparse(sm_models, coefflist = None, coefflist_dropdummies = False, instrument = None):
+    """
+    getcoeffmatrices but return coefflist and a SparseCoeffMatrix holding only the coefficients each model actually has
+
+    Useful for tables with many models that each have a few coefficients of their own since nothing is stored for the empty cells.
+    """
+    import numpy as np
+
+    if instrument is not None:
+        starttime = instrument.start()
+
+    coefflist, coeffrows = getcoeffrows(sm_models, coefflist = coefflist, coefflist_dropdummies = coefflist_dropdummies)
+
+    rows = []
+    cols = []
+    betas = []
+    pvals = []
+    ses = []
+    for col in range(len(sm_models)):
+        if sm_models[col] is None:
+            continue
+        coeffs, modelbetas, modelpvals, modelses = getmodelcoeffs(sm_models[col])
+        # rows of the coefficients of this model that are in the table
+        modelrows = np.fromiter((coeffrows.get(coeff, -1) for coeff in coeffs), dtype = np.intp, count = len(coeffs))
+        intable = modelrows >= 0
+        rows.append(modelrows[intable])
+        cols.append(np.full(int(intable.sum()), col, dtype = np.intp))
+        betas.append(np.asarray(modelbetas, dtype = float)[intable])
+        pvals.append(np.asarray(modelpvals, dtype = float)[intable])
+        ses.append(np.asarray(modelses, dtype = float)[intable])
+
+    if len(rows) > 0:
+        sparse = SparseCoeffMatrix((len(coefflist), len(sm_models)), np.concatenate(rows), np.concatenate(cols), np.concatenate(betas), np.concatenate(pvals), np.concatenate(ses))
+    else:
+        sparse = SparseCoeffMatrix((len(coefflist), len(sm_models)), [], [], [], [], [])
+
+    if instrument is not None:
+        instrument.record('extractcoeffs', starttime, cells = len(sparse.betas))
+
+    return(coefflist, sparse)
+
+
+def getcoeffmatrices_sparse_test():
+    models = getmodelstest()
+    coefflist, sparse = getcoeffmatrices_sparse(models)
+    print(coefflist)
+    print(sparse)
+    print(sparse.todense()[0])
+
+
+def getparammatrix(sm_models, paramlist = 'def', instrument = None):
+    """
+    sm_models should be a list of model.fit() from statsmodels or ModelSummary (which must include the stats in paramlist)
+    Stats are cached per model (see getmodelstats) so making several tables from the same models only computes each stat once
+    instrument = None: TabInstrument to record the time taken
+    """
+    if instrument is not None:
+        starttime = instrument.start()
+
+    paramlist = getparamlist(paramlist)
 
     numcol = len(sm_models)
     numrow = len(paramlist)
@@ -129,11 +334,15 @@ def getparammatrix(sm_models, paramlist = 'def'):
     parammatrix = [parammatrix[i: i + numcol] for i in range(0, len(parammatrix), numcol)]
 
     for col in range(numcol):
+        if sm_models[col] is None:
+            continue
+        # get all the stats for the model at once and reuse any I already got for an earlier table
+        modelstats = getmodelstats(sm_models[col], paramlist)
         for row in range(numrow):
-            if sm_models[col] is None:
-                parammatrix[row][col] = None
-            else:
-                parammatrix[row][col] = getattr(sm_models[col], paramlist[row])
+            parammatrix[row][col] = modelstats[row]
+
+    if instrument is not None:
+        instrument.record('extractparams', starttime, cells = numrow * numcol)
 
     return(paramlist, parammatrix)
 
@@ -156,7 +365,9 @@ def getcoefftabmatrix(
     # print options
     printtab = False, printmaxcolsize = None,
     # output options
-    returntabsec = False,
+    returntabsec = False, returnframe = False,
+    # instrumentation
+    instrument = None,
     ):
     """
     Returns a listoflist of following form:
@@ -167,13 +378,13 @@ def getcoefftabmatrix(
     i.e. row of coefficients with stars for a given variable with standard deviations in brackets in next row
 
     coeff matrix arguments:
-    sm_models: list of statsmodels.fit()
+    sm_models: list of statsmodels.fit() or ModelSummary (from getmodelsummaries)
     coefflist = list of variables to show in the tabsec
 
     format arguments:
     coeffnames = list of names to use in table (same length as coefflist) OR dictionary from name in statsmodel to name I want in the tabular (can contain superfluous names)
     coeffdecimal = 3: decimal places in coefficients and standard errors
-    stardict = 'def' then use default i.e. * <0.05, ** <0.01, *** < 0.001. If None/{} then do not include
+    stardict = 'def' then use default i.e. * <0.05, ** <0.01, *** < 0.001. If None/{} then do not include. Can also be a StarMarker from getstarmarker which is useful when making many tables with the same custom stardict
 
     print options:
     printtab = False. If True then print the listoflists
@@ -181,10 +392,14 @@ def getcoefftabmatrix(
 
     output options:
     returntabsec = False. If True then return tabsec rather than listoflists
+    returnframe = False. If True then return a TabularFrame rather than listoflists
+
+    instrument = None: TabInstrument to record the time taken in each stage
     """
 
     # get matrices
-    coefflist, betamatrix, pvalmatrix, sematrix = getcoeffmatrices(sm_models, coefflist = coefflist, coefflist_dropdummies = coefflist_dropdummies)
+    # only the coefficients each model has are stored so this scales with the number of filled cells in the table
+    coefflist, sparse = getcoeffmatrices_sparse(sm_models, coefflist = coefflist, coefflist_dropdummies = coefflist_dropdummies, instrument = instrument)
 
     # get the coefflist to show in the table
     if coeffnames is None:
@@ -194,11 +409,8 @@ def getcoefftabmatrix(
             # coeffnames is already fine
             None
         elif isinstance(coeffnames, dict):
-            coeffnamesdict = coeffnames
-            coeffnames = copy.deepcopy(coefflist)
-            for i in range(len(coeffnames)):
-                if coeffnames[i] in coeffnamesdict:
-                    coeffnames[i] = coeffnamesdict[coeffnames[i]]
+            # new list so coefflist and the dict are left as they are
+            coeffnames = [coeffnames.get(coeff, coeff) for coeff in coefflist]
         else:
             raise ValueError('Type for coeffnames not defined.')
 
@@ -206,16 +418,20 @@ def getcoefftabmatrix(
     # also print if I want to
     coefftabmatrix = getcoefftabmatrixgen(
     # matrix inputs
-    coeffnames, betamatrix, pvalmatrix, sematrix, 
+    coeffnames, sparse, None, None,
     # format otions
     stardict = stardict, coeffdecimal = coeffdecimal,
     # print options
     printtab = printtab, printmaxcolsize = printmaxcolsize,
+    # output options
+    returnframe = returnframe,
+    # instrumentation
+    instrument = instrument,
     )
 
     # maybe convert into a tabsec
     if returntabsec is True:
-        coefftabmatrix = tabularconvert(coefftabmatrix)
+        coefftabmatrix = tabularconvert(coefftabmatrix, instrument = instrument)
 
     return(coefftabmatrix)
         
@@ -258,11 +474,13 @@ def getparamtabmatrix(
     # print options
     printtab = False, printmaxcolsize = None,
     # output options
-    returntabsec = False,
+    returntabsec = False, returnframe = False,
+    # instrumentation
+    instrument = None,
     ):
     """
     matrix arguments:
-    sm_models: a list of statsmodels.fit() models
+    sm_models: a list of statsmodels.fit() models or ModelSummary (from getmodelsummaries)
     paramlist = 'def': list of properties of the fit() method that I wish to include in the parameter table e.g. nobs, ess, aic, rsquared. If None, include nothing. If 'def', include 'nobs'
     For list of parameters see: https://www.statsmodels.org/dev/generated/statsmodels.regression.linear_model.RegressionResults.html#statsmodels.regression.linear_model.RegressionResults
 
@@ -275,7 +493,9 @@ def getparamtabmatrix(
     printmaxcolsize = None: Can be an integer or list to specify the max size of a row when printing
 
     returntabsec = False. If True then return tabsec rather than listoflists
-    
+    returnframe = False. If True then return a TabularFrame rather than listoflists
+
+    instrument = None: TabInstrument to record the time taken in each stage
     """
     if paramlist == 'def':
         paramlist = ['nobs', 'rsquared']
@@ -300,9 +520,10 @@ def getparamtabmatrix(
     if len(paramnames) != numrow:
         raise ValueError('paramnames is the wrong length.')
 
-    paramlist, parammatrix = getparammatrix(sm_models, paramlist = paramlist)
-
+    paramlist, parammatrix = getparammatrix(sm_models, paramlist = paramlist, instrument = instrument)
 
+    if instrument is not None:
+        starttime = instrument.start()
 
     # apply decimals
     for i in range(numrow):
@@ -316,12 +537,17 @@ def getparamtabmatrix(
     for i in range(numrow):
         parammatrix[i] = [paramnames[i]] + parammatrix[i]
 
+    if instrument is not None:
+        instrument.record('formatparams', starttime, cells = numrow * numcol)
+
     if printtab is True:
-        printlofl(parammatrix, maxcolsize = printmaxcolsize)
+        printlofl(parammatrix, maxcolsize = printmaxcolsize, instrument = instrument)
 
     # maybe convert into a tabsec
     if returntabsec is True:
-        parammatrix = tabularconvert(parammatrix)
+        parammatrix = tabularconvert(parammatrix, instrument = instrument)
+    elif returnframe is True:
+        parammatrix = TabularFrame.fromlofl(parammatrix)
 
     return(parammatrix)
 
@@ -356,24 +582,26 @@ def getsmresultstable(
     # format options - param
     paramnames = None, paramdecimal = None,
     # format options - other
-    ynames = None, colalign = 'def', hlines_tabsec = 'all',
+    ynames = None, colalign = 'def', hlines_tabsec = 'all', env = 'tabular', chunkrows = None,
     # additional list of lists before/between/after other matrices
     beforelofl = None, betweenlofl = None, afterlofl = None,
     # print options
     printtab = False, printmaxcolsize = None,
     # output options
-    savename = None,
+    savename = None, csvname = None,
+    # instrumentation
+    instrument = None,
     ):
     """
     coeff matrix arguments:
-    sm_models: list of statsmodels.fit()
+    sm_models: list of statsmodels.fit() or ModelSummary (from getmodelsummaries)
     coefflist = list of variables to show in the tabsec
     paramlist = 'def': list of properties of the fit() method that I wish to include in the parameter table e.g. nobs, ess, aic. If None, include nothing. If 'def', include 'nobs'. Example: ['nobs', 'rsquared'].
 
     format arguments - coeff:
     coeffnames = list of names to use in table (same length as coefflist) OR dictionary from name in statsmodel to name I want in the tabular (can contain superfluous names). This will also replace any names that appear in ynames that are in the dict.
     coeffdecimal = 3: decimal places in coefficients and standard errors
-    stardict = 'def' then use default i.e. * <0.05, ** <0.01, *** < 0.001. If None/{} then do not include
+    stardict = 'def' then use default i.e. * <0.05, ** <0.01, *** < 0.001. If None/{} then do not include. Can also be a StarMarker from getstarmarker which is useful when making many tables with the same custom stardict
 
     format arguments - param:
     paramnames = None: Names for the parameters that I'll put in tabular. If paramlist == 'def' then equals N. 
@@ -381,6 +609,8 @@ def getsmresultstable(
 
     format options - y:
     ynames = None: Specifies how to describe the y variables. If None, then just put (1), (2), (3) etc. If string, still include the numbers but put the variable in the top left. If a list the same length as the number of columns + 1. If coeffnames is a dict, also replaces ynames.
+    env = 'tabular': use 'longtable' for tables that should break across pages. The beforelofl and ynames rows are repeated at the top of each page.
+    chunkrows = None: with env = 'tabular', split the table into separate tabulars of chunkrows rows that each start with the beforelofl and ynames rows. Use an even number so coefficients stay with their standard errors. See tabularenv_iter.
 
     print options:
     printtab = False. If True then print the listoflists
@@ -388,7 +618,10 @@ def getsmresultstable(
 
     output options:
     savename: place where I can save the output file
+    csvname = None: also save the table as a csv (or tab-separated if csvname ends in .tsv). The csv, tabular and printed table are all produced in the same pass over the table.
 
+    instrumentation:
+    instrument = None: TabInstrument to record the time taken in each stage. Use the same TabInstrument across many tables to get totals for all of them.
     """
 
     numcol = len(sm_models)
@@ -407,10 +640,11 @@ def getsmresultstable(
             ynames = [[ynames] + ['(' + str(i) + ')' for i in range(1, numcol + 1)]]
         elif isinstance(ynames[0], str):
             # replace name using coeffnames dict if coeffnames is a dict containing the name
+            # make a new row rather than changing the ynames that was passed in
             if isinstance(coeffnames, dict):
-                for i in range(0, numcol + 1):
-                    if ynames[i] in coeffnames:
-                        ynames[i] = coeffnames[ynames[i]]
+                ynames = [coeffnames.get(yname, yname) for yname in ynames[: numcol + 1]] + ynames[numcol + 1: ]
+            else:
+                ynames = list(ynames)
             ynames = [ynames]
         else:
             None
@@ -421,6 +655,10 @@ def getsmresultstable(
     sm_models, coefflist = coefflist, coefflist_dropdummies = coefflist_dropdummies,
     # format options
     coeffnames = coeffnames, coeffdecimal = coeffdecimal, stardict = stardict,
+    # output options
+    returnframe = True,
+    # instrumentation
+    instrument = instrument,
     )
 
     if paramlist is not None and paramlist is not []:
@@ -430,44 +668,45 @@ def getsmresultstable(
         sm_models, paramlist = paramlist,
         # format
         paramnames = paramnames, paramdecimal = paramdecimal,
+        # output options
+        returnframe = True,
+        # instrumentation
+        instrument = instrument,
         )
 
-    lofl_all = []
-    tabsecs_all = []
-
+    # each matrix is one section of the frame (and so one tabsec)
+    frames = []
     if beforelofl is not None:
-        lofl_all = lofl_all + beforelofl
-        tabsecs_all.append(tabularconvert(beforelofl))
-
-    lofl_all = lofl_all + ynames
-    tabsecs_all.append(tabularconvert(ynames))
-
-    lofl_all = lofl_all + coefftabmatrix
-    tabsecs_all.append(tabularconvert(coefftabmatrix))
-
+        frames.append(beforelofl)
+    frames.append(ynames)
+    frames.append(coefftabmatrix)
     if betweenlofl is not None:
-        lofl_all = lofl_all + betweenlofl
-        tabsecs_all.append(tabularconvert(betweenlofl))
-
+        frames.append(betweenlofl)
     if paramlist is not None and paramlist is not []:
-        lofl_all = lofl_all + paramtabmatrix
-        tabsecs_all.append(tabularconvert(paramtabmatrix))
-
+        frames.append(paramtabmatrix)
     if afterlofl is not None:
-        lofl_all = lofl_all + afterlofl
-        tabsecs_all.append(tabularconvert(afterlofl))
-
-    # full listoflists
-    if printtab is True:
-        printlofl(lofl_all, maxcolsize = printmaxcolsize)
+        frames.append(afterlofl)
+    frame_all = TabularFrame.concat(frames)
 
     if colalign == 'def':
         colalign = 'l' + 'c' * numcol
 
-    # CONVERT ALL LISTS TO TABSECS
-    tabular = mergetabsecs(tabsecs_all, colalign = colalign, hlines = hlines_tabsec, savename = savename)
+    # rows repeated at the top of each page/chunk
+    # empty rows are dropped from the tabular so they do not count
+    headrows = len([row for row in ynames if len(row) > 0])
+    if beforelofl is not None:
+        headrows += len([row for row in beforelofl if len(row) > 0])
 
-    return(tabular)
+    # RENDER THE TABULAR, PREVIEW AND CSV IN ONE PASS OVER THE FRAME
+    latextarget = LatexTarget(colalign = colalign, savename = savename, env = env, headrows = headrows, chunkrows = chunkrows, instrument = instrument)
+    targets = [latextarget]
+    if printtab is True:
+        targets.append(TextTarget(maxcolsize = printmaxcolsize))
+    if csvname is not None:
+        targets.append(CsvTarget(csvname))
+    rendertargets(frame_all, targets, hlines = hlines_tabsec, instrument = instrument)
+
+    return(latextarget.tabular)
 
 
 def getsmresultstable_test():
@@ -498,3 +737,118 @@ def getsmresultstable_test():
     savename = savename,
     )
 
+# Batch:{{{1
+def getsmresultstable_spec(spec):
+    """
+    Run getsmresultstable for a single table spec
+
+    spec is a dict with sm_models and any other arguments of getsmresultstable
+    Returns a dict with savename, tabular, error (None or the traceback as a string), instrumentstats (the stats from spec['instrument'] or None) and changed (whether savename was changed or left alone since it was already the same)
+    """
+    spec = dict(spec)
+    try:
+        sm_models = spec.pop('sm_models')
+        tabular = getsmresultstable(sm_models, **spec)
+        error = None
+    except Exception:
+        import traceback
+        tabular = None
+        error = traceback.format_exc()
+
+    if spec.get('instrument') is not None:
+        instrumentstats = spec['instrument'].stats
+    else:
+        instrumentstats = None
+
+    # whether savename was changed (None if there is no savename or it was not written)
+    if spec.get('savename') is not None and error is None:
+        changed = getoutputchanged(spec['savename'])
+    else:
+        changed = None
+
+    return({'savename': spec.get('savename'), 'tabular': tabular, 'error': error, 'instrumentstats': instrumentstats, 'changed': changed})
+
+
+def getsmresultstables(specs, processes = None, instrument = None):
+    """
+    Render many tables with getsmresultstable across a pool of processes
+
+    specs: list of dicts with sm_models and any other arguments of getsmresultstable (including savename)
+    processes = None: number of processes (None means the number of cpus). If 1 then run in this process
+    instrument = None: TabInstrument to add the time taken in each stage across all the tables to
+
+    Fitted models are converted to ModelSummary before they are sent to the processes so only the numbers in the table are pickled.
+    Returns a list of dicts with savename, tabular, error and changed in the same order as specs. An error in one table does not stop the other tables.
+    Each spec is sent to the pool on its own so a spec that cannot be pickled (or a pool that breaks) only gives an error for the tables affected.
+    """
+    specs2 = []
+    for spec in specs:
+        spec = dict(spec)
+        try:
+            spec['sm_models'] = getmodelsummaries(spec['sm_models'], paramlist = spec.get('paramlist', 'def'))
+        except Exception:
+            # leave the models as they are so the error is reported for this table when it is rendered
+            None
+        if instrument is not None:
+            # each table records its own stats which I add to instrument at the end
+            spec['instrument'] = TabInstrument()
+        specs2.append(spec)
+
+    if processes == 1:
+        results = [getsmresultstable_spec(spec) for spec in specs2]
+    else:
+        import concurrent.futures
+        import traceback
+        with concurrent.futures.ProcessPoolExecutor(max_workers = processes) as executor:
+            # a future for each spec or the traceback if it could not be submitted
+            futures = []
+            for spec in specs2:
+                try:
+                    futures.append(executor.submit(getsmresultstable_spec, spec))
+                except Exception:
+                    futures.append(traceback.format_exc())
+
+            results = []
+            for i in range(len(specs2)):
+                if isinstance(futures[i], str):
+                    error = futures[i]
+                else:
+                    try:
+                        results.append(futures[i].result())
+                        continue
+                    except Exception:
+                        error = traceback.format_exc()
+                results.append({'savename': specs2[i].get('savename'), 'tabular': None, 'error': error, 'instrumentstats': None, 'changed': None})
+
+    if instrument is not None:
+        for result in results:
+            if result['instrumentstats'] is not None:
+                instrument.addstats(result['instrumentstats'])
+
+    # outputs written in the other processes are added to changedoutputs in this process
+    for result in results:
+        if result['changed'] is not None:
+            changedoutputs[os.path.abspath(result['savename'])] = result['changed']
+
+    return(results)
+
+
+def getsmresultstables_test():
+    models = getmodelstest()
+
+    specs = []
+    for i in range(1, len(models) + 1):
+        specs.append({'sm_models': models[: i], 'coeffdecimal': i, 'savename': __projectdir__ / Path('temp/getsmresultstables_test_' + str(i) + '.tex')})
+    # a table with an error
+    specs.append({'sm_models': models, 'paramlist': ['notastat']})
+
+    instrument = TabInstrument()
+    results = getsmresultstables(specs, processes = 2, instrument = instrument)
+    for result in results:
+        if result['error'] is None:
+            print(result['tabular'])
+        else:
+            print(result['error'])
+
+    instrument.printstats()
+
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+import json
+import os
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+
+__projectdir__ = Path(os.path.dirname(os.path.realpath(__file__)) + '/')
+
+from tab_sm_func import ModelSummary
+from tab_sm_func import getmodelsummaries
+
+# Defaults:{{{1
+storeversion = 1
+# arrays saved in the store folder (each as name.npy)
+storearrays = ['coeffids', 'betas', 'pvals', 'ses', 'offsets', 'present', 'stats', 'statspresent']
+# file in the store folder with the name of the folder holding the current version (and on the next line the version it replaced)
+storepointer = 'current'
+
+# Save Store:{{{1
+def savestore(sm_models, storedir, paramlist = 'def'):
+    """
+    Save what I need for tables from a list of fitted models (or ModelSummary or None) as a folder of numpy arrays that can be memory-mapped
+
+    Each save is written to a new folder storedir/version_* with:
+    names.json: coefficient names (each stored once), stat names and number of models
+    coeffids.npy: index in the coefficient names of each coefficient of each model (models one after another)
+    betas.npy, pvals.npy, ses.npy: values of each coefficient of each model
+    offsets.npy: the coefficients of model i are in [offsets[i], offsets[i + 1])
+    present.npy: False for models that are None
+    stats.npy: nummodels x numstats array of stats with statspresent.npy showing which each model has
+
+    paramlist: stats to save (same options as getsmresultstable) if sm_models are fitted models
+    Once the folder is written in full, storedir/current is replaced (atomically) with its name so readers only ever see a complete version and processes saving at the same time do not overwrite each other's files.
+    """
+    import numpy as np
+
+    summaries = getmodelsummaries(sm_models, paramlist = paramlist)
+
+    # each coefficient and stat name stored once
+    coeffindex = {}
+    statindex = {}
+    for summary in summaries:
+        if summary is None:
+            continue
+        for coeffname in summary.coeffnames:
+            coeffindex.setdefault(coeffname, len(coeffindex))
+        for statname in summary.stats:
+            statindex.setdefault(statname, len(statindex))
+
+    present = [summary is not None for summary in summaries]
+    present_summaries = [summary for summary in summaries if summary is not None]
+    offsets = np.zeros(len(summaries) + 1, dtype = np.int64)
+    offsets[1: ] = np.cumsum([0 if summary is None else len(summary.coeffnames) for summary in summaries])
+
+    stats = np.full((len(summaries), len(statindex)), np.nan)
+    statspresent = np.zeros((len(summaries), len(statindex)), dtype = bool)
+    for i in range(len(summaries)):
+        if summaries[i] is None:
+            continue
+        for statname in summaries[i].stats:
+            stats[i, statindex[statname]] = summaries[i].stats[statname]
+            statspresent[i, statindex[statname]] = True
+
+    arrays = {
+        'coeffids': np.array([coeffindex[coeffname] for summary in present_summaries for coeffname in summary.coeffnames], dtype = np.int64),
+        'betas': np.concatenate([summary.betas for summary in present_summaries] + [np.zeros(0)]),
+        'pvals': np.concatenate([summary.pvals for summary in present_summaries] + [np.zeros(0)]),
+        'ses': np.concatenate([summary.ses for summary in present_summaries] + [np.zeros(0)]),
+        'offsets': offsets,
+        'present': np.array(present, dtype = bool),
+        'stats': stats,
+        'statspresent': statspresent,
+        }
+    names = {'version': storeversion, 'nummodels': len(summaries), 'coeffnames': list(coeffindex), 'statnames': list(statindex)}
+
+    storedir = os.path.abspath(storedir)
+    os.makedirs(storedir, exist_ok = True)
+
+    # write the new version to its own folder
+    # tmp_ folders are still being written so are never removed by other processes
+    tempdir = tempfile.mkdtemp(dir = storedir, prefix = 'tmp_')
+    try:
+        for name in storearrays:
+            np.save(os.path.join(tempdir, name + '.npy'), arrays[name])
+        with open(os.path.join(tempdir, 'names.json'), 'w+') as f:
+            json.dump(names, f)
+        versionname = 'version_' + os.path.basename(tempdir)[len('tmp_'): ]
+        os.rename(tempdir, os.path.join(storedir, versionname))
+    except BaseException:
+        shutil.rmtree(tempdir, ignore_errors = True)
+        raise
+
+    # publish it by replacing the pointer
+    oldversionname, olderversionname = getstoreversionnames(storedir)
+    fd, temppointer = tempfile.mkstemp(dir = storedir, prefix = 'tmp_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(versionname + '\n' + ('' if oldversionname is None else oldversionname) + '\n')
+        os.replace(temppointer, os.path.join(storedir, storepointer))
+    except BaseException:
+        os.remove(temppointer)
+        raise
+
+    # remove the version that the version I replaced had replaced and the files of a store saved before versions were used
+    # I keep the version I replaced so a reader that just resolved the pointer can still open it
+    # I only remove a version that was published so a version another process has written but not yet published is never removed
+    # (if two processes save at the same time, the version of one is never published or removed and stays in the folder)
+    # processes that already have older arrays memory-mapped keep reading them
+    if olderversionname is not None and olderversionname != versionname:
+        shutil.rmtree(os.path.join(storedir, olderversionname), ignore_errors = True)
+    for entry in os.scandir(storedir):
+        if entry.name in ['names.json'] + [name + '.npy' for name in storearrays]:
+            os.remove(entry.path)
+
+
+# Load Store:{{{1
+def getstoreversionnames(storedir):
+    """
+    Return the names of the folders in storedir with the current version and the version it replaced
+
+    Either is None if there is no pointer (i.e. a store saved before versions were used) or no version was replaced
+    """
+    try:
+        with open(os.path.join(storedir, storepointer)) as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return(None, None)
+    lines = [line.strip() for line in lines] + ['', '']
+    return(lines[0] or None, lines[1] or None)
+
+
+def getstoreversionname(storedir):
+    """
+    Return the name of the folder in storedir with the current version or None if there is no pointer (i.e. a store saved before versions were used)
+    """
+    return(getstoreversionnames(storedir)[0])
+
+
+def loadstorearrays(storedir, mmap = True):
+    """
+    Return the dict in names.json and a dict of the arrays in the store
+
+    mmap = True: memory-map the arrays so nothing is read until it is used and processes opening the same store share the pages
+    The pointer is read once and every file is read from the version it names so the names and arrays always come from the same save.
+    """
+    import numpy as np
+
+    versionname = getstoreversionname(storedir)
+    while True:
+        if versionname is None:
+            versiondir = storedir
+        else:
+            versiondir = os.path.join(storedir, versionname)
+        try:
+            with open(os.path.join(versiondir, 'names.json')) as f:
+                names = json.load(f)
+            if names.get('version') != storeversion:
+                raise ValueError('Store ' + str(storedir) + ' has version ' + str(names.get('version')) + ' but I can only read version ' + str(storeversion) + '.')
+
+            arrays = {}
+            for name in storearrays:
+                arrays[name] = np.load(os.path.join(versiondir, name + '.npy'), mmap_mode = 'r' if mmap is True else None, allow_pickle = False)
+        except FileNotFoundError:
+            # the version was removed by two saves since I read the pointer so read the new one
+            newversionname = getstoreversionname(storedir)
+            if newversionname is None or newversionname == versionname:
+                raise
+            versionname = newversionname
+            continue
+
+        return(names, arrays)
+
+
+def loadstore(storedir, models = None, mmap = True):
+    """
+    Return a list of ModelSummary (or None) from a store made by savestore
+
+    models = None: indices of the models to load (None in the list for an empty column). If None, load every model.
+    The betas, pvals and ses of each ModelSummary are views of the memory-mapped arrays so they are not copied.
+    """
+    names, arrays = loadstorearrays(storedir, mmap = mmap)
+    coeffnames = names['coeffnames']
+    statnames = names['statnames']
+    offsets = arrays['offsets'].tolist()
+    present = arrays['present']
+
+    if models is None:
+        models = range(names['nummodels'])
+
+    summaries = []
+    for i in models:
+        if i is None or not present[i]:
+            summaries.append(None)
+            continue
+        start = offsets[i]
+        end = offsets[i + 1]
+        modelcoeffnames = [coeffnames[coeffid] for coeffid in arrays['coeffids'][start: end].tolist()]
+        statvalues = arrays['stats'][i].tolist()
+        statspresent = arrays['statspresent'][i].tolist()
+        stats = {statnames[j]: statvalues[j] for j in range(len(statnames)) if statspresent[j] is True}
+        summaries.append(ModelSummary(modelcoeffnames, arrays['betas'][start: end], arrays['pvals'][start: end], arrays['ses'][start: end], stats = stats))
+
+    return(summaries)
+
+
+def loadstore_test():
+    from tab_sm_func import getmodelstest
+    from tab_sm_func import getsmresultstable
+
+    models = getmodelstest()
+    storedir = __projectdir__ / Path('temp/loadstore_test.tabstore')
+    savestore(models + [None], storedir, paramlist = ['nobs', 'rsquared'])
+
+    summaries = loadstore(storedir, models = [2, 3, 0])
+    print(summaries)
+    getsmresultstable(summaries, printtab = True)